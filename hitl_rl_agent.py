@@ -3,13 +3,15 @@ import copy
 import logging
 import itertools
 import pickle
+import shelve
+import os
 
 class HITL_RL_Agent:
     """
     An Agent that uses Human-in-the-Loop Reinforcement Learning to modify melodies.
     """
 
-    def __init__(self, generator, learning_rate, discount_factor, initial_epsilon, decay_rate, log_filename):
+    def __init__(self, generator, learning_rate, discount_factor, initial_epsilon, decay_rate, log_filename, max_q_entries=None, spill_filename=None, visit_decay=0.99):
         """
         Initialize the HITL_RL_Agent.
         
@@ -18,7 +20,13 @@ class HITL_RL_Agent:
             learning_rate: The learning rate for Q-learning updates.
             discount_factor: The discount factor for future rewards in Q-learning.
             log_filename: The logger filename based on user_id and datetime.
+            max_q_entries (int, optional): Maximum number of (state, action) entries kept in memory. The state being updated is never evicted, so the table can exceed the cap by that state's own entries. Defaults to None (unbounded).
+            spill_filename (str, optional): Shelve file that evicted entries are spilled to and restored from. It is truncated on first use, so entries never carry over between agents. Defaults to None (evicted entries are discarded).
+            visit_decay (float, optional): Per-step decay applied to a state's visit count, so that eviction favours states visited both often and recently. Defaults to 0.99.
         """
+        if max_q_entries is not None and (isinstance(max_q_entries, bool) or not isinstance(max_q_entries, int) or max_q_entries < 1):
+            raise ValueError(f'max_q_entries must be a positive integer or None, got {max_q_entries!r}')
+
         self.generator = generator
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
@@ -26,23 +34,215 @@ class HITL_RL_Agent:
         self.initial_epsilon = initial_epsilon
         self.decay_rate = decay_rate
 
+        # Memory cap bookkeeping: state -> set of explored actions, state -> [decayed visit count, step of last visit]
+        self.max_q_entries = max_q_entries
+        self.spill_filename = spill_filename
+        self.visit_decay = visit_decay
+        self.state_actions = {}
+        self.state_stats = {}
+        self.step_counter = 0
+        self.evicted_entries = 0
+        self.spilled_entries = 0
+        self.restored_entries = 0
+
+        # Spill handle is opened lazily on the first eviction; spilled_hashes counts spilled states by hash to avoid disk lookups on misses.
+        # It holds one small int per spilled state and is not counted towards max_q_entries.
+        self.spill = None
+        self.spill_opened = False
+        self.spilled_hashes = {}
+
         # Configure the logger
         logging.basicConfig(filename=log_filename, encoding='utf-8', format='%(name)s - %(levelname)s - %(message)s')
         logging.getLogger().setLevel(logging.DEBUG)
 
     def log_q_table(self):
         logging.info(f'Final Q Table: {self.q_table}')
+        logging.info(f'Q Table memory stats: {self.get_memory_stats()}')
+
+    def get_memory_stats(self):
+        """
+        Return size, eviction and spill metrics for the Q-table.
+        """
+        return {
+            'entries': len(self.q_table),
+            'states': len(self.state_actions),
+            'max_entries': self.max_q_entries,
+            'spilled_states': sum(self.spilled_hashes.values()),
+            'evicted_entries': self.evicted_entries,
+            'spilled_entries': self.spilled_entries,
+            'restored_entries': self.restored_entries,
+        }
+
+    def close(self, delete_spill=False):
+        """
+        Close the spill file, if one is open. Spilled entries stay reachable and the file is reopened on demand.
+
+        Args:
+            delete_spill (bool, optional): Also delete the spill file, discarding every spilled entry. Defaults to False.
+        """
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+        if delete_spill and self.spill_filename is not None:
+            # The shelve backend decides which of these files it creates
+            for suffix in ('', '.db', '.dat', '.dir', '.bak'):
+                if os.path.exists(self.spill_filename + suffix):
+                    os.remove(self.spill_filename + suffix)
+            self.spill_opened = False
+            self.spilled_hashes = {}
+
+    def _open_spill(self):
+        """
+        Return the spill shelve, truncating it the first time it is opened.
+        """
+        if self.spill is None:
+            self.spill = shelve.open(self.spill_filename, flag='c' if self.spill_opened else 'n')
+            self.spill_opened = True
+        return self.spill
+
+    def _visit_score(self, state):
+        """
+        Return the visit count of a state, decayed by the number of steps since its last visit.
+        """
+        visits, last_step = self.state_stats[state]
+        return visits * self.visit_decay ** (self.step_counter - last_step)
+
+    def _record_visit(self, state):
+        if state in self.state_stats:
+            self.state_stats[state] = [self._visit_score(state) + 1, self.step_counter]
+        else:
+            self.state_stats[state] = [1, self.step_counter]
+
+    def _spilled_entries(self):
+        """
+        Yield (state, stats, actions) for every spilled state.
+        """
+        if not self.spilled_hashes:
+            return
+        for state, stats, actions in self._open_spill().values():
+            yield state, stats, actions
+
+    def _restore_state(self, state):
+        """
+        Reload the entries of a previously spilled state back into the Q-table.
+        """
+        key_hash = hash(state)
+        if key_hash not in self.spilled_hashes or state in self.state_actions:
+            return
+
+        entries = self._open_spill().pop(repr(state), None)
+        if entries is None:
+            # Hash collision with another spilled state
+            return
+
+        self.spilled_hashes[key_hash] -= 1
+        if not self.spilled_hashes[key_hash]:
+            del self.spilled_hashes[key_hash]
+
+        _, stats, actions = entries
+        for action, q_value in actions.items():
+            self.q_table[(state, action)] = q_value
+        self.state_actions[state] = set(actions)
+        self.state_stats[state] = stats
+        self.restored_entries += len(actions)
+        logging.debug(f'Restored {len(actions)} spilled Q-table entries')
+
+    def _enforce_memory_cap(self, protected_state):
+        """
+        Once the Q-table exceeds max_q_entries, evict states down to 90% of the cap.
+        States are ranked by decayed visit count, then best Q-value, then recency, and the lowest ranked are evicted first.
+        """
+        if self.max_q_entries is None or len(self.q_table) <= self.max_q_entries:
+            return
+
+        low_water_mark = max(1, int(self.max_q_entries * 0.9))
+
+        candidates = sorted(
+            (state for state in self.state_actions if state != protected_state),
+            key=lambda s: (
+                self._visit_score(s),
+                max(self.q_table[(s, a)] for a in self.state_actions[s]),
+                self.state_stats[s][1]
+            )
+        )
+
+        spill = self._open_spill() if self.spill_filename is not None else None
+
+        for state in candidates:
+            if len(self.q_table) <= low_water_mark:
+                break
+            actions = {action: self.q_table.pop((state, action)) for action in self.state_actions.pop(state)}
+            stats = self.state_stats.pop(state)
+            self.evicted_entries += len(actions)
+            if spill is not None:
+                spill[repr(state)] = (state, stats, actions)
+                key_hash = hash(state)
+                self.spilled_hashes[key_hash] = self.spilled_hashes.get(key_hash, 0) + 1
+                self.spilled_entries += len(actions)
+
+        if spill is not None:
+            spill.sync()
+
+        logging.debug(f'Q-table memory cap reached, stats: {self.get_memory_stats()}')
 
     def save_q_table(self, user_id):
+        """
+        Save the Q-table, including any spilled entries, together with the per-state visit statistics.
+        Entries are written one state at a time so that spilled states are never all held in memory.
+        """
         with open('q_table_'+user_id+'.pkl', 'wb') as f:
-            pickle.dump(self.q_table, f)
+            pickle.dump({'format': 2, 'step_counter': self.step_counter}, f)
+            for state, actions in self.state_actions.items():
+                pickle.dump((state, self.state_stats[state], {action: self.q_table[(state, action)] for action in actions}), f)
+            for entry in self._spilled_entries():
+                pickle.dump(entry, f)
 
     def load_q_table(self, user_id):
+        """
+        Load a saved Q-table, replacing the current one. The memory cap is enforced while loading.
+        """
+        previous_stats = self.state_stats
+        self.close(delete_spill=True)
+        self.q_table = {}
+        self.state_actions = {}
+        self.state_stats = {}
+
         with open('q_table_'+user_id+'.pkl', 'rb') as f:
-            self.q_table = pickle.load(f)
+            header = pickle.load(f)
+            if 'format' in header:
+                self.step_counter = max(self.step_counter, header['step_counter'])
+                while True:
+                    try:
+                        state, stats, actions = pickle.load(f)
+                    except EOFError:
+                        break
+                    self._load_state(state, stats, actions)
+            else:
+                # Older saves contain the whole Q-table in a single dict, optionally alongside the visit stats
+                q_table, saved_stats = (header['q_table'], header['state_stats']) if 'q_table' in header else (header, {})
+                state_actions = {}
+                for (state, action), q_value in q_table.items():
+                    state_actions.setdefault(state, {})[action] = q_value
+                del q_table
+                for state, actions in state_actions.items():
+                    # Prefer saved stats, then stats already tracked, then approximate by the number of explored actions
+                    stats = saved_stats.get(state) or previous_stats.get(state) or [len(actions), self.step_counter]
+                    self._load_state(state, stats, actions)
+
+    def _load_state(self, state, stats, actions):
+        for action, q_value in actions.items():
+            self.q_table[(state, action)] = q_value
+        self.state_actions[state] = set(actions)
+        self.state_stats[state] = stats
+        self._enforce_memory_cap(None)
         
     def update_q(self, track_array, reward, episode_number):
         state = (tuple(tuple(note) for note in track_array[0]), tuple(track_array[1]))
+
+        self.step_counter += 1
+        self._restore_state(state)
+        self._record_visit(state)
         
         epsilon = self.initial_epsilon * (self.decay_rate ** episode_number)
 
@@ -75,5 +275,7 @@ class HITL_RL_Agent:
             )[1]
         updated_q = current_q + self.learning_rate * (reward + self.discount_factor * max_next_q - current_q)
         self.q_table[(state, action)] = updated_q
+        self.state_actions.setdefault(state, set()).add(action)
+        self._enforce_memory_cap(state)
 
         return new_track_array
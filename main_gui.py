@@ -292,7 +292,7 @@ while True:
 
         # Load the music generator and the RL agent
         generator = MusicGenerator(base_note, scale_type, tempo, volume, chords_flag, percussion_flag, chord_freq, track_array_length)
-        hitl_rl = HITL_RL_Agent(generator, learning_rate = 0.1, discount_factor = 0.9, initial_epsilon = 0.5, decay_rate = 0.01, log_filename=log_filename)
+        hitl_rl = HITL_RL_Agent(generator, learning_rate = 0.1, discount_factor = 0.9, initial_epsilon = 0.5, decay_rate = 0.01, log_filename=log_filename, max_q_entries = 100000, spill_filename = 'q_spill_'+user_id)
         track_array = generator.generate_random_track_array(array_length=track_array_length)
         
         modified_midi_path = f"midiFiles/modified_melody_ep_{episode}_step_{step}.mid"
@@ -400,6 +400,7 @@ while True:
             hitl_rl.log_q_table()
             hitl_rl.save_q_table(user_id)
             hitl_rl.load_q_table(user_id)
+            hitl_rl.close(delete_spill=True)
 
     # Update the screen
     pygame.display.flip()
@@ -0,0 +1,167 @@
+import os
+import random
+import tempfile
+import unittest
+
+from hitl_rl_agent import HITL_RL_Agent
+
+
+class StubGenerator:
+    """
+    Minimal stand-in for MusicGenerator that shifts the pitch of the selected note.
+    """
+    def apply_action(self, track_array, action):
+        action_type, index = action
+        track_array[0][index][0] = (track_array[0][index][0] + action_type + 1) % 12
+
+
+class StaticGenerator:
+    """
+    Generator stub that leaves the track unchanged, so every update hits the same state.
+    """
+    def apply_action(self, track_array, action):
+        pass
+
+
+class TestQTableMemoryCap(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.old_cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        self.tmp_dir.cleanup()
+
+    def make_agent(self, generator=None, **kwargs):
+        agent = HITL_RL_Agent(generator or StubGenerator(), learning_rate=0.1, discount_factor=0.9, initial_epsilon=0.5, decay_rate=0.01, log_filename='test.log', **kwargs)
+        self.addCleanup(agent.close)
+        return agent
+
+    def run_agent(self, agent, steps, seed=1):
+        random.seed(seed)
+        track_array = [[[0, 1], [2, 3], [4, 5], [6, 7]], [1, 2, 3, 4]]
+        for i in range(steps):
+            track_array = agent.update_q(track_array, random.randint(1, 10), i // 4)
+            self.assertLessEqual(len(agent.q_table), agent.max_q_entries or len(agent.q_table))
+
+    def test_equivalent_under_cap(self):
+        uncapped = self.make_agent()
+        capped = self.make_agent(max_q_entries=10000, spill_filename='q_spill_test')
+        self.run_agent(uncapped, 300)
+        self.run_agent(capped, 300)
+        self.assertEqual(uncapped.q_table, capped.q_table)
+        self.assertEqual(capped.get_memory_stats()['evicted_entries'], 0)
+        self.assertFalse(any(name.startswith('q_spill_test') for name in os.listdir('.')))
+
+    def test_evicts_to_low_water_mark(self):
+        agent = self.make_agent(max_q_entries=10)
+        self.run_agent(agent, 300)
+        stats = agent.get_memory_stats()
+        self.assertGreater(stats['evicted_entries'], 0)
+        self.assertEqual(stats['spilled_entries'], 0)
+        self.assertEqual(set(agent.state_actions), set(agent.state_stats))
+        self.assertEqual(sum(len(a) for a in agent.state_actions.values()), len(agent.q_table))
+
+    def test_spill_round_trip(self):
+        uncapped = self.make_agent()
+        capped = self.make_agent(max_q_entries=10, spill_filename='q_spill_test')
+        self.run_agent(uncapped, 300)
+        self.run_agent(capped, 300)
+        stats = capped.get_memory_stats()
+        self.assertGreater(stats['spilled_entries'], 0)
+        self.assertGreater(stats['restored_entries'], 0)
+
+        # Spilling loses nothing, so the merged table matches the uncapped run
+        capped.save_q_table('test')
+        reloaded = self.make_agent()
+        reloaded.load_q_table('test')
+        self.assertEqual(reloaded.q_table, uncapped.q_table)
+
+    def test_load_keeps_visit_stats(self):
+        agent = self.make_agent()
+        self.run_agent(agent, 100)
+        state_stats = dict(agent.state_stats)
+        agent.save_q_table('test')
+        agent.load_q_table('test')
+        self.assertEqual(agent.state_stats, state_stats)
+
+    def test_spill_not_reused_by_new_agent(self):
+        first = self.make_agent(max_q_entries=10, spill_filename='q_spill_test')
+        self.run_agent(first, 300)
+        first.close()
+
+        second = self.make_agent(max_q_entries=10000, spill_filename='q_spill_test')
+        self.run_agent(second, 300)
+        self.assertEqual(second.get_memory_stats()['restored_entries'], 0)
+
+    def test_load_enforces_cap(self):
+        uncapped = self.make_agent()
+        self.run_agent(uncapped, 300)
+        uncapped.save_q_table('full')
+
+        capped = self.make_agent(max_q_entries=10, spill_filename='q_spill_test')
+        capped.load_q_table('full')
+        self.assertLessEqual(len(capped.q_table), 10)
+        self.assertGreater(capped.get_memory_stats()['spilled_entries'], 0)
+
+        capped.save_q_table('resaved')
+        reloaded = self.make_agent()
+        reloaded.load_q_table('resaved')
+        self.assertEqual(reloaded.q_table, uncapped.q_table)
+
+    def test_close_keeps_spill_reachable(self):
+        uncapped = self.make_agent()
+        capped = self.make_agent(max_q_entries=10, spill_filename='q_spill_test')
+        self.run_agent(uncapped, 150)
+        self.run_agent(capped, 150)
+        capped.close()
+
+        # Saving after close still includes spilled entries
+        capped.save_q_table('test')
+        reloaded = self.make_agent()
+        reloaded.load_q_table('test')
+        self.assertEqual(reloaded.q_table, uncapped.q_table)
+
+        # Updating after close restores spilled states and keeps learning identical
+        self.run_agent(uncapped, 150, seed=2)
+        capped.close()
+        self.run_agent(capped, 150, seed=2)
+        capped.save_q_table('test')
+        reloaded.load_q_table('test')
+        self.assertEqual(reloaded.q_table, uncapped.q_table)
+
+    def test_close_deletes_spill(self):
+        agent = self.make_agent(max_q_entries=10, spill_filename='q_spill_test')
+        self.run_agent(agent, 150)
+        self.assertTrue(any(name.startswith('q_spill_test') for name in os.listdir('.')))
+        agent.close(delete_spill=True)
+        self.assertFalse(any(name.startswith('q_spill_test') for name in os.listdir('.')))
+        self.assertEqual(agent.get_memory_stats()['spilled_states'], 0)
+
+    def test_cap_smaller_than_one_state(self):
+        agent = self.make_agent(generator=StaticGenerator(), max_q_entries=2)
+        random.seed(1)
+        track_array = [[[0, 1], [2, 3], [4, 5], [6, 7]], [1, 2, 3, 4]]
+        for _ in range(30):
+            agent.update_q(track_array, random.randint(1, 10), 0)
+
+        # The state being updated is never evicted, so the cap is exceeded by its own entries only
+        self.assertEqual(len(agent.state_actions), 1)
+        self.assertGreater(len(agent.q_table), 2)
+        self.assertLessEqual(len(agent.q_table), 5 * len(track_array[0]))
+
+        # Moving on to another state evicts the previous one
+        other_track_array = [[[1, 1], [2, 3], [4, 5], [6, 7]], [1, 2, 3, 4]]
+        agent.update_q(other_track_array, 5, 0)
+        self.assertEqual(len(agent.q_table), 1)
+
+    def test_rejects_invalid_cap(self):
+        for value in (0, -5, 2.5, True, '100'):
+            with self.assertRaises(ValueError):
+                self.make_agent(max_q_entries=value)
+
+
+if __name__ == '__main__':
+    unittest.main()